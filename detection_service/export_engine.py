@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Сборка TensorRT engine (или ONNX-модели для ONNX Runtime) для YOLOv8
+Engine собирается один раз на целевом GPU: он привязан к модели GPU и версии TensorRT
+"""
+
+import argparse
+import logging
+import os
+
+import torch
+from ultralytics import YOLO
+
+logger = logging.getLogger(__name__)
+
+# INT8 Tensor Cores доступны начиная с Turing (sm_75)
+INT8_MIN_CAPABILITY = (7, 5)
+
+def export_engine(weights, imgsz=640, workspace=4, int8=False, calib_images=None, batch=8):
+    """Экспорт .pt весов в FP16 или INT8 TensorRT engine, возвращает путь к файлу
+
+    Профиль оптимизации динамический по пачке: от 1 до batch кадров за один forward.
+    INT8 калибруется по изображениям из каталога calib_images
+    """
+    model = YOLO(weights)
+    precision = 'int8' if int8 else 'fp16'
+    logger.info(f"🔧 Exporting {weights} to {precision} TensorRT engine (imgsz={imgsz}, batch<={batch}, workspace={workspace}GB)")
+
+    if int8:
+        if not calib_images:
+            raise RuntimeError("INT8 engine export requires a directory of calibration images")
+        if torch.cuda.get_device_capability() < INT8_MIN_CAPABILITY:
+            logger.warning("⚠️ GPU has no INT8 Tensor Cores (sm_75+), INT8 engine may be slower than FP16")
+
+        # В Ultralytics 8.0.196 нет INT8-экспорта: калибровка и сборка из ONNX через TensorRT API
+        from int8_calibration import build_int8_engine
+
+        onnx_path = model.export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True, opset=17)
+        metadata = {
+            'stride': int(max(model.model.stride)),
+            'task': model.task,
+            'batch': batch,
+            'imgsz': [imgsz, imgsz],
+            'names': model.names
+        }
+        engine_path = build_int8_engine(
+            onnx_path, os.path.splitext(onnx_path)[0] + '.engine', calib_images, metadata,
+            imgsz=imgsz, batch=batch, workspace=workspace
+        )
+    else:
+        engine_path = model.export(
+            format='engine', half=True, imgsz=imgsz, workspace=workspace, batch=batch, dynamic=True
+        )
+    logger.info(f"✅ Engine saved to {engine_path}")
+    return engine_path
+
+def export_onnx(weights, imgsz=640, opset=17):
+    """Экспорт .pt весов в ONNX со статической формой входа, возвращает путь к файлу"""
+    logger.info(f"🔧 Exporting {weights} to ONNX (imgsz={imgsz}, opset={opset})")
+    onnx_path = YOLO(weights).export(format='onnx', imgsz=imgsz, opset=opset, dynamic=False, simplify=True)
+    logger.info(f"✅ ONNX model saved to {onnx_path}")
+    return onnx_path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export YOLOv8 weights to TensorRT engine or ONNX')
+    parser.add_argument('--weights', default='yolov8n.pt', help='Path to .pt weights')
+    parser.add_argument('--imgsz', type=int, default=640, help='Inference image size')
+    parser.add_argument('--workspace', type=int, default=4, help='TensorRT workspace size in GB')
+    parser.add_argument('--batch', type=int, default=8, help='Max batch size of the dynamic engine profile')
+    parser.add_argument('--int8', action='store_true', help='Build INT8 engine with entropy calibration')
+    parser.add_argument('--calib-images', help='Directory with images used for INT8 calibration')
+    parser.add_argument('--onnx', action='store_true', help='Export ONNX model for ONNX Runtime instead of engine')
+    args = parser.parse_args()
+
+    # Только для CLI: при импорте из сервиса логирование настраивает main.py (QueueHandler, LOG_LEVEL)
+    logging.basicConfig(level=logging.INFO)
+    if args.onnx:
+        export_onnx(args.weights, imgsz=args.imgsz)
+    else:
+        try:
+            export_engine(args.weights, imgsz=args.imgsz, workspace=args.workspace, int8=args.int8,
+                          calib_images=args.calib_images, batch=args.batch)
+        except RuntimeError as e:
+            raise SystemExit(str(e))
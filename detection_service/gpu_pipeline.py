@@ -0,0 +1,218 @@
+"""
+GPU-конвейер инференса YOLOv8 в обход предиктора Ultralytics
+Сырые кадры копируются на GPU через переиспользуемый pinned-буфер в отдельном CUDA stream
+(или JPEG декодируется сразу на GPU через nvJPEG), letterbox и нормализация выполняются на GPU.
+Модель - PyTorch (forward для одиночных кадров - повтором CUDA Graph) или TensorRT engine в AutoBackend
+"""
+
+import logging
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torchvision.io import decode_jpeg
+from ultralytics.utils import ops
+
+logger = logging.getLogger(__name__)
+
+LETTERBOX_PAD_VALUE = 114
+# Прогоны перед захватом графа: cuDNN autotune и аллокации должны пройти до capture
+GRAPH_WARMUP_ITERATIONS = 3
+# Допуск сверки повтора графа с eager forward (FP16, координаты в пикселях)
+GRAPH_CHECK_RTOL = 1e-3
+GRAPH_CHECK_ATOL = 1e-2
+# Начальный размер буфера сырых кадров: один кадр 1080p BGR
+INITIAL_RAW_BUFFER_BYTES = 1920 * 1080 * 3
+
+def engine_max_batch_size(backend):
+    """Максимальная пачка TensorRT engine: максимум профиля для динамического, размер входа для статического"""
+    if backend.dynamic:
+        return backend.model.get_profile_shape(0, 'images')[2][0]
+    return backend.bindings['images'].shape[0]
+
+def letterbox_geometry(height, width, imgsz):
+    """Размер после масштабирования и отступы для вписывания в квадрат imgsz x imgsz (паддинг по центру)"""
+    ratio = min(imgsz / height, imgsz / width)
+    new_height, new_width = round(height * ratio), round(width * ratio)
+    return new_height, new_width, (imgsz - new_height) // 2, (imgsz - new_width) // 2
+
+class PinnedInferencePipeline:
+    """Инференс модели YOLO (PyTorch или TensorRT AutoBackend) с переиспользуемыми pinned/device буферами"""
+
+    def __init__(self, model, device, half, imgsz=640, max_batch_size=8, conf=0.25, iou=0.45, max_det=100,
+                 use_cuda_graph=True):
+        self.device = torch.device(device)
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+
+        self.engine = getattr(model, 'engine', False)
+        self.fixed_batch = False
+        if self.engine:
+            # Точность и слияние слоёв заданы при сборке engine; тип входа - по его binding.
+            # execute_v2 синхронный и в CUDA Graph не захватывается
+            half = model.fp16
+            engine_batch = engine_max_batch_size(model)
+            # Статический engine принимает только полную пачку: неполные дополняются
+            self.fixed_batch = not model.dynamic
+            max_batch_size = engine_batch if self.fixed_batch else min(max_batch_size, engine_batch)
+            use_cuda_graph = False
+            self.model = model
+            logger.info(f"📐 TensorRT engine batch size: {max_batch_size} "
+                        f"(engine max={engine_batch}, dynamic={model.dynamic})")
+        else:
+            model = model.fuse(verbose=False).to(self.device).eval()
+            self.model = model.half() if half else model.float()
+        self.names = model.names
+        self.half = half
+        self.dtype = torch.float16 if half else torch.float32
+        self.max_batch_size = max_batch_size
+
+        # Буферы выделяются один раз: pinned-память копируется DMA без промежуточного staging
+        self.h_raw = torch.empty(0, dtype=torch.uint8)
+        self.d_raw = torch.empty(0, dtype=torch.uint8, device=self.device)
+        self._ensure_raw_capacity(INITIAL_RAW_BUFFER_BYTES)
+        self.d_batch = torch.empty((max_batch_size, 3, imgsz, imgsz), dtype=self.dtype, device=self.device)
+        self.stream = torch.cuda.Stream(self.device)
+
+        self.graph = None
+        if use_cuda_graph:
+            try:
+                self._capture_graph()
+                self._verify_graph()
+            except Exception as e:
+                logger.warning(f"⚠️ CUDA Graph capture failed, using eager forward: {e}")
+                self.graph = None
+
+    def _ensure_raw_capacity(self, nbytes):
+        """Увеличить буферы сырых кадров, если пачка в них не помещается"""
+        if self.h_raw.numel() >= nbytes:
+            return
+        self.h_raw = torch.empty(nbytes, dtype=torch.uint8, pin_memory=True)
+        self.d_raw = torch.empty(nbytes, dtype=torch.uint8, device=self.device)
+
+    def _capture_graph(self):
+        """Захватить forward для пачки из одного кадра; входной и выходной тензоры статические"""
+        with torch.inference_mode():
+            self.static_input = torch.zeros((1, 3, self.imgsz, self.imgsz), dtype=self.dtype, device=self.device)
+
+            self.stream.wait_stream(torch.cuda.current_stream(self.device))
+            with torch.cuda.stream(self.stream):
+                for _ in range(GRAPH_WARMUP_ITERATIONS):
+                    self.model(self.static_input)
+            torch.cuda.current_stream(self.device).wait_stream(self.stream)
+
+            # Промежуточные тензоры графа живут в его приватном пуле памяти и переиспользуются
+            graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(graph, stream=self.stream):
+                self.static_output = self.model(self.static_input)[0]
+
+        # Граф читает anchors/strides головы Detect по адресу, а Detect.forward пересоздаёт их
+        # при смене размера пачки: без сильных ссылок память уйдёт другим тензорам
+        head = self.model.model[-1]
+        self._graph_keepalive = (head.anchors, head.strides)
+
+        self.graph = graph
+        logger.info("📸 CUDA Graph captured for single-image forward")
+
+    def _verify_graph(self):
+        """Сверить повтор графа после eager-пачки из max_batch_size кадров с eager forward для одного кадра"""
+        with torch.inference_mode(), torch.cuda.stream(self.stream):
+            probe = torch.rand_like(self.static_input)
+            expected = self.model(probe)[0].clone()
+
+            # Eager-пачка другого размера пересоздаёт anchors/strides в голове Detect
+            self.d_batch.zero_()
+            self.model(self.d_batch)
+
+            self.static_input.copy_(probe)
+            self.graph.replay()
+            matches = torch.allclose(self.static_output.float(), expected.float(),
+                                     rtol=GRAPH_CHECK_RTOL, atol=GRAPH_CHECK_ATOL)
+        self.stream.synchronize()
+
+        if not matches:
+            raise RuntimeError("CUDA Graph replay diverges from eager forward after a batched pass")
+
+    def decode_jpeg(self, data):
+        """nvJPEG: декодировать JPEG сразу в память GPU; возвращает CHW RGB uint8 тензор"""
+        return decode_jpeg(torch.frombuffer(bytearray(data), dtype=torch.uint8), device=self.device)
+
+    def __call__(self, images):
+        """Детекция на списке изображений: BGR np.ndarray (HWC) или CHW RGB тензоров на GPU из decode_jpeg
+
+        Возвращает тензоры [N, 6] в координатах исходников
+        """
+        detections = []
+        for start in range(0, len(images), self.max_batch_size):
+            detections.extend(self._run_chunk(images[start:start + self.max_batch_size]))
+        return detections
+
+    def _upload(self, images):
+        """Скопировать сырые кадры в pinned-буфер и асинхронно на GPU; возвращает HWC uint8 view на устройстве"""
+        self._ensure_raw_capacity(sum(image.nbytes for image in images))
+        h_view = self.h_raw.numpy()
+
+        uploaded = []
+        offset = 0
+        for image in images:
+            size = image.nbytes
+            h_view[offset:offset + size] = np.ascontiguousarray(image).reshape(-1)
+            self.d_raw[offset:offset + size].copy_(self.h_raw[offset:offset + size], non_blocking=True)
+            uploaded.append(self.d_raw[offset:offset + size].view(image.shape))
+            offset += size
+        return uploaded
+
+    def _letterbox_into(self, image, out):
+        """Letterbox на GPU для CHW RGB uint8: resize, паддинг и /255 прямо в out (3 x imgsz x imgsz)"""
+        height, width = image.shape[1:]
+        new_height, new_width, top, left = letterbox_geometry(height, width, self.imgsz)
+
+        x = image.unsqueeze(0).to(self.dtype)
+        if (new_height, new_width) != (height, width):
+            x = F.interpolate(x, size=(new_height, new_width), mode='bilinear', align_corners=False)
+
+        out.fill_(LETTERBOX_PAD_VALUE / 255)
+        out[:, top:top + new_height, left:left + new_width] = x[0] / 255
+
+    def _run_chunk(self, images):
+        """Один forward для пачки не больше max_batch_size"""
+        count = len(images)
+        use_graph = self.graph is not None and count == 1
+
+        # Кадры, декодированные nvJPEG, записаны в другом stream
+        self.stream.wait_stream(torch.cuda.current_stream(self.device))
+        shapes = [image.shape[1:] if isinstance(image, torch.Tensor) else image.shape[:2] for image in images]
+
+        with torch.inference_mode(), torch.cuda.stream(self.stream):
+            uploaded = iter(self._upload([image for image in images if not isinstance(image, torch.Tensor)]))
+
+            # Для графа пишем в тот же объект static_input, иначе он прочитает старые данные
+            batch = self.static_input if use_graph else self.d_batch[:count]
+            for image, out in zip(images, batch):
+                if isinstance(image, torch.Tensor):
+                    image.record_stream(self.stream)
+                else:
+                    # BGR -> RGB, HWC -> CHW
+                    image = next(uploaded).permute(2, 0, 1).flip(0)
+                self._letterbox_into(image, out)
+
+            if use_graph:
+                self.graph.replay()
+                preds = self.static_output
+            elif self.engine:
+                # AutoBackend запускает engine вне нашего stream: вход должен быть готов
+                self.stream.synchronize()
+                preds = self.model(self.d_batch if self.fixed_batch else batch)
+            else:
+                preds = self.model(batch)
+
+            detections = ops.non_max_suppression(preds, self.conf, self.iou, max_det=self.max_det)[:count]
+            for det, shape in zip(detections, shapes):
+                if det.shape[0]:
+                    det[:, :4] = ops.scale_boxes((self.imgsz, self.imgsz), det[:, :4], shape)
+
+        # pinned-буфер можно перезаписывать только после завершения копии
+        self.stream.synchronize()
+        return detections
@@ -0,0 +1,89 @@
+"""
+gRPC-сервер YOLO Detection Service
+Для сервисов на том же хосте: байты изображения или ссылка на /dev/shm вместо HTTP+JSON.
+Работает в event loop воркера и использует тот же планировщик пачек, что и HTTP-эндпоинты
+"""
+
+import asyncio
+import logging
+from multiprocessing import resource_tracker, shared_memory
+
+import grpc
+from fastapi.concurrency import run_in_threadpool
+
+import detector_pb2
+import detector_pb2_grpc
+
+logger = logging.getLogger(__name__)
+
+def read_shared_memory(ref):
+    """Скопировать закодированное изображение из сегмента shared memory"""
+    segment = shared_memory.SharedMemory(name=ref.name)
+    try:
+        # Сегментом владеет клиент: без этого resource_tracker удалит его при выходе воркера
+        resource_tracker.unregister(segment._name, 'shared_memory')
+        if ref.offset + ref.size > segment.size:
+            raise ValueError(f"Range {ref.offset}+{ref.size} is outside of segment {ref.name} ({segment.size} bytes)")
+        return bytes(segment.buf[ref.offset:ref.offset + ref.size])
+    finally:
+        segment.close()
+
+class DetectorServicer(detector_pb2_grpc.DetectorServicer):
+    """Реализация сервиса Detector поверх планировщика пачек"""
+
+    def __init__(self, scheduler, decode_image, timeout):
+        self.scheduler = scheduler
+        self.decode_image = decode_image
+        self.timeout = timeout
+
+    async def Detect(self, request, context):
+        """Детекция по изображению из запроса"""
+        try:
+            if request.HasField('shm'):
+                # Копия сегмента может быть большой - не блокируем event loop
+                data = await run_in_threadpool(read_shared_memory, request.shm)
+            else:
+                data = request.image
+            if not data:
+                raise ValueError("Missing image data in request")
+            image = await self.decode_image(data)
+        except Exception as e:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, f"Failed to read image: {e}")
+
+        try:
+            # Колоночный формат: массивы сразу раскладываются в protobuf без промежуточных словарей
+            result = await asyncio.wait_for(
+                self.scheduler.submit(image, request.image_name or None, columnar=True), self.timeout
+            )
+        except asyncio.TimeoutError:
+            await context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "Detection timed out")
+
+        if not result['success']:
+            return detector_pb2.DetectResponse(success=False, error=result['error'])
+
+        detections = result['detections']
+        return detector_pb2.DetectResponse(
+            success=True,
+            detections=[
+                detector_pb2.Detection(
+                    x1=x1, y1=y1, x2=x2, y2=y2, confidence=confidence, class_id=class_id, class_name=class_name
+                )
+                for (x1, y1, x2, y2), confidence, class_id, class_name in zip(
+                    detections['bbox'].tolist(),
+                    detections['confidence'].tolist(),
+                    detections['class_id'].tolist(),
+                    detections['class']
+                )
+            ],
+            total_objects=result['total_objects'],
+            processing_time_ms=result['processing_time_ms'],
+            model_confidence_threshold=result['model_confidence_threshold']
+        )
+
+def create_grpc_server(scheduler, decode_image, address, timeout=30):
+    """Создать grpc.aio сервер (запускается через await server.start() в event loop воркера)"""
+    server = grpc.aio.server()
+    detector_pb2_grpc.add_DetectorServicer_to_server(DetectorServicer(scheduler, decode_image, timeout), server)
+    server.add_insecure_port(address)
+    logger.info(f"📡 gRPC server configured on {address}")
+    return server
@@ -0,0 +1,35 @@
+"""
+Конфигурация gunicorn для YOLO Detection Service
+Воркеры uvicorn (uvloop): в каждом один event loop с планировщиком пачек.
+Каждый воркер после fork загружает свою модель и создаёт свой CUDA-контекст
+"""
+
+import os
+import subprocess
+import sys
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+# Один воркер держит GPU занятым через планировщик пачек; больше - только для нескольких GPU/CPU-хостов
+workers = int(os.getenv('GUNICORN_WORKERS', '1'))
+worker_class = 'uvicorn.workers.UvicornWorker'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '300'))
+
+# Модель не должна загружаться в мастер-процессе: CUDA-контексты не переживают fork
+preload_app = False
+
+# Доля памяти GPU на воркер, с запасом под CUDA-контексты
+gpu_memory_fraction = float(os.getenv('GPU_MEMORY_FRACTION', str(round(0.9 / workers, 2))))
+
+def on_starting(server):
+    """Сборка TensorRT engine в ENGINE_CACHE_DIR до fork воркеров
+    
+    В отдельном процессе: CUDA в мастере не инициализируется, сборка не упирается в timeout воркера,
+    и воркеры не собирают один и тот же engine параллельно
+    """
+    if os.getenv('ENGINE_CACHE_DIR'):
+        subprocess.run([sys.executable, '-c', 'import main; main.prepare_engine_cache()'], check=False)
+
+def post_worker_init(worker):
+    """Загрузка модели в каждом воркере сразу после fork, до запуска event loop"""
+    from main import initialize_detector
+    initialize_detector(memory_fraction=gpu_memory_fraction)
@@ -0,0 +1,132 @@
+"""
+INT8-калибровка TensorRT engine для YOLOv8 (IInt8EntropyCalibrator2)
+Ultralytics 8.0.196 не умеет INT8-экспорт, поэтому engine собирается из ONNX напрямую через TensorRT API
+"""
+
+import glob
+import json
+import logging
+import os
+
+import cv2
+import numpy as np
+import tensorrt as trt
+import torch
+
+from gpu_pipeline import LETTERBOX_PAD_VALUE, letterbox_geometry
+
+logger = logging.getLogger(__name__)
+
+CALIBRATION_IMAGE_PATTERNS = ('*.jpg', '*.jpeg', '*.png')
+# Энтропийной калибровке хватает нескольких сотен кадров
+MAX_CALIBRATION_IMAGES = 512
+
+def list_calibration_images(image_dir, limit=MAX_CALIBRATION_IMAGES):
+    """Изображения для калибровки из каталога (рекурсивно), не больше limit"""
+    paths = sorted(
+        path
+        for pattern in CALIBRATION_IMAGE_PATTERNS
+        for path in glob.glob(os.path.join(image_dir, '**', pattern), recursive=True)
+    )
+    return paths[:limit]
+
+def letterbox_blob(image, imgsz):
+    """Та же предобработка, что при инференсе: letterbox, BGR -> RGB, HWC -> CHW, /255"""
+    height, width = image.shape[:2]
+    new_height, new_width, top, left = letterbox_geometry(height, width, imgsz)
+
+    if (new_height, new_width) != (height, width):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    canvas = np.full((imgsz, imgsz, 3), LETTERBOX_PAD_VALUE, dtype=np.uint8)
+    canvas[top:top + new_height, left:left + new_width] = image
+    return canvas[..., ::-1].transpose(2, 0, 1).astype(np.float32) / 255
+
+class EntropyCalibrator(trt.IInt8EntropyCalibrator2):
+    """Подаёт в TensorRT пачки кадров из каталога; таблица масштабов сохраняется в cache_path"""
+
+    def __init__(self, image_paths, imgsz, batch, cache_path):
+        trt.IInt8EntropyCalibrator2.__init__(self)
+        self.image_paths = image_paths
+        self.imgsz = imgsz
+        self.batch = batch
+        self.cache_path = cache_path
+        self.index = 0
+        self.d_input = torch.empty((batch, 3, imgsz, imgsz), dtype=torch.float32, device='cuda')
+
+    def get_batch_size(self):
+        return self.batch
+
+    def get_batch(self, names):
+        """Следующая пачка на GPU; неполная последняя пачка отбрасывается"""
+        if self.index + self.batch > len(self.image_paths):
+            return None
+
+        blobs = []
+        for path in self.image_paths[self.index:self.index + self.batch]:
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is None:
+                logger.warning(f"⚠️ Skipping unreadable calibration image: {path}")
+                image = np.full((self.imgsz, self.imgsz, 3), LETTERBOX_PAD_VALUE, dtype=np.uint8)
+            blobs.append(letterbox_blob(image, self.imgsz))
+
+        self.d_input.copy_(torch.from_numpy(np.stack(blobs)))
+        self.index += self.batch
+        return [int(self.d_input.data_ptr())]
+
+    def read_calibration_cache(self):
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path, 'rb') as f:
+                return f.read()
+        return None
+
+    def write_calibration_cache(self, cache):
+        with open(self.cache_path, 'wb') as f:
+            f.write(cache)
+
+def build_int8_engine(onnx_path, engine_path, image_dir, metadata, imgsz=640, batch=8, workspace=4):
+    """Собрать INT8 engine с динамической пачкой 1..batch из ONNX-модели, возвращает путь к файлу"""
+    image_paths = list_calibration_images(image_dir)
+    if len(image_paths) < batch:
+        raise RuntimeError(f"INT8 calibration needs at least {batch} images in {image_dir}, found {len(image_paths)}")
+
+    trt_logger = trt.Logger(trt.Logger.INFO)
+    builder = trt.Builder(trt_logger)
+    network = builder.create_network(1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH))
+    parser = trt.OnnxParser(network, trt_logger)
+    if not parser.parse_from_file(onnx_path):
+        errors = '; '.join(str(parser.get_error(i)) for i in range(parser.num_errors))
+        raise RuntimeError(f"Failed to parse {onnx_path}: {errors}")
+
+    config = builder.create_builder_config()
+    config.set_memory_pool_limit(trt.MemoryPoolType.WORKSPACE, workspace << 30)
+    # Слои без INT8-реализации остаются в FP16, а не в FP32
+    config.set_flag(trt.BuilderFlag.INT8)
+    config.set_flag(trt.BuilderFlag.FP16)
+
+    input_name = network.get_input(0).name
+    shape = (3, imgsz, imgsz)
+    profile = builder.create_optimization_profile()
+    profile.set_shape(input_name, (1, *shape), (max(1, batch // 2), *shape), (batch, *shape))
+    config.add_optimization_profile(profile)
+
+    # Калибровка идёт пачками фиксированного размера
+    calibration_profile = builder.create_optimization_profile()
+    calibration_profile.set_shape(input_name, (batch, *shape), (batch, *shape), (batch, *shape))
+    config.set_calibration_profile(calibration_profile)
+    config.int8_calibrator = EntropyCalibrator(
+        image_paths, imgsz, batch, os.path.splitext(engine_path)[0] + '.calib'
+    )
+
+    logger.info(f"🎯 Calibrating INT8 engine on {len(image_paths) // batch * batch} images from {image_dir}")
+    serialized = builder.build_serialized_network(network, config)
+    if serialized is None:
+        raise RuntimeError(f"TensorRT failed to build INT8 engine from {onnx_path}")
+
+    # Формат Ultralytics: длина и JSON метаданных перед engine, их читает AutoBackend
+    meta = json.dumps(metadata)
+    with open(engine_path, 'wb') as f:
+        f.write(len(meta).to_bytes(4, byteorder='little', signed=True))
+        f.write(meta.encode())
+        f.write(serialized)
+    return engine_path
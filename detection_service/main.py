@@ -4,169 +4,740 @@ YOLOv8 Detection Service
 Микросервис для детекции объектов с использованием YOLOv8
 """
 
+import asyncio
+import atexit
+import fcntl
+import gc
+import hashlib
 import os
 import logging
-from flask import Flask, request, jsonify
+import queue
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from ultralytics import YOLO
+from ultralytics.nn.autobackend import AutoBackend
+from ultralytics.utils.downloads import attempt_download_asset
+import uvicorn
+import cv2
 import numpy as np
+import torch
 import time
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+from export_engine import export_engine
+from gpu_pipeline import PinnedInferencePipeline
+from onnx_pipeline import OnnxRuntimePipeline
+
+# Настройка логирования: запись в stdout - в отдельном потоке, потоки запросов только кладут записи в очередь
+log_queue = queue.SimpleQueue()
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+log_listener = QueueListener(log_queue, log_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), handlers=[QueueHandler(log_queue)])
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+@asynccontextmanager
+async def lifespan(app):
+    """Загрузка модели, запуск планировщика пачек и gRPC-сервера в event loop воркера"""
+    global scheduler
+    scheduler = create_scheduler(get_detector())
+    scheduler.start()
+    
+    grpc_server = None
+    grpc_port = int(os.getenv('GRPC_PORT', '50051'))
+    if create_grpc_server is not None and grpc_port:
+        grpc_server = create_grpc_server(
+            scheduler, decode_request_image, f"[::]:{grpc_port}", timeout=DETECT_RESULT_TIMEOUT
+        )
+        await grpc_server.start()
+    
+    yield
+    
+    if grpc_server is not None:
+        await grpc_server.stop(grace=5)
+    await scheduler.stop()
+
+# ORJSONResponse сериализует numpy-массивы и скаляры (OPT_SERIALIZE_NUMPY)
+app = FastAPI(title='YOLO Detection Service', lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# TensorRT нужен только для сборки engine в кеш; без него работаем с .pt
+try:
+    import tensorrt
+except ImportError:
+    tensorrt = None
+
+# gRPC-стабы генерируются из detector.proto при сборке образа; без них работает только HTTP
+try:
+    from grpc_server import create_grpc_server
+except ImportError as e:
+    logger.warning(f"⚠️ gRPC server is not available: {e}")
+    create_grpc_server = None
+
+# SIMD-декодер JPEG (libjpeg-turbo); без него декодируем через OpenCV
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError) as e:
+    logger.warning(f"⚠️ TurboJPEG is not available, using OpenCV for decoding: {e}")
+    turbo_jpeg = None
+
+JPEG_MAGIC = b'\xff\xd8'
+
+TRT_PRECISIONS = ('fp16', 'int8')
+
+# При B=16 на небольших GPU наблюдается OOM, B=8 - оптимум по задержке
+MAX_BATCH_SIZE_LIMIT = 8
+
+# Оставшиеся FP32 matmul на Ampere+ выполняются через TF32
+torch.set_float32_matmul_precision('high')
+
+def file_sha1(path):
+    """sha1 содержимого файла"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_cached_engine(weights, cache_dir, precision='fp16'):
+    """Engine из кеша на томе; при промахе собирается из весов и сохраняется в кеш
+    
+    Ключ кеша - содержимое весов, модель GPU, версия TensorRT, точность и максимальная пачка:
+    engine не переносим между ними, а замена весов под тем же именем даёт новый ключ
+    """
+    weights = attempt_download_asset(weights)
+    key = hashlib.sha1(
+        f"{file_sha1(weights)}|{torch.cuda.get_device_name(0)}|{tensorrt.__version__}|{precision}"
+        f"|b{MAX_BATCH_SIZE_LIMIT}".encode()
+    ).hexdigest()
+    engine_path = os.path.join(cache_dir, f"{key}.engine")
+    
+    if os.path.exists(engine_path):
+        logger.info(f"📦 Using cached TensorRT engine: {engine_path}")
+        return engine_path
+    
+    os.makedirs(cache_dir, exist_ok=True)
+    # Собирает один процесс (воркер или контейнер на том же томе), остальные ждут и берут готовый engine
+    with open(f"{engine_path}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(engine_path):
+            logger.info(f"📦 Using TensorRT engine built by another process: {engine_path}")
+            return engine_path
+        
+        logger.info(f"🔧 TensorRT engine cache miss, building {precision} engine from {weights}")
+        # Ultralytics пишет .onnx/.engine рядом с весами - собираем из копии в своём каталоге.
+        # Каталог на том же томе: готовый engine атомарно переносится в кеш через os.replace
+        with tempfile.TemporaryDirectory(dir=cache_dir) as build_dir:
+            built_path = export_engine(
+                shutil.copy(weights, build_dir),
+                int8=precision == 'int8',
+                calib_images=os.getenv('TRT_CALIB_IMAGES'),
+                batch=MAX_BATCH_SIZE_LIMIT
+            )
+            os.replace(built_path, engine_path)
+    logger.info(f"✅ TensorRT engine cached: {engine_path}")
+    return engine_path
+
+def resolve_model_path(model_path):
+    """Выбор файла модели: TensorRT engine требует GPU, engine и ONNX - собранного файла, иначе берём .pt
+    
+    Для .pt при заданном ENGINE_CACHE_DIR на GPU с TensorRT используется engine из кеша
+    """
+    if model_path.endswith(('.engine', '.onnx')):
+        fallback = os.path.splitext(model_path)[0] + '.pt'
+        if model_path.endswith('.engine') and not torch.cuda.is_available():
+            logger.warning(f"⚠️ CUDA is not available, falling back from {model_path} to {fallback}")
+        elif not os.path.exists(model_path):
+            logger.warning(f"⚠️ {model_path} not found (run export_engine.py), falling back to {fallback}")
+        else:
+            return model_path
+        model_path = fallback
+    
+    cache_dir = os.getenv('ENGINE_CACHE_DIR')
+    precision = os.getenv('TRT_PRECISION', 'fp16')
+    if precision not in TRT_PRECISIONS:
+        raise ValueError(f"TRT_PRECISION must be one of {TRT_PRECISIONS}, got {precision!r}")
+    
+    if cache_dir and torch.cuda.is_available() and tensorrt is not None:
+        # Если INT8 не собрался (нет калибровочных кадров и т.п.), сначала пробуем FP16 engine
+        for candidate in dict.fromkeys([precision, 'fp16']):
+            try:
+                return get_cached_engine(model_path, cache_dir, candidate)
+            except Exception as e:
+                logger.error(f"❌ Failed to build {candidate} TensorRT engine: {e}")
+        logger.warning(f"⚠️ Using {model_path} without TensorRT")
+    return model_path
+
+def prepare_engine_cache():
+    """Собрать engine для YOLO_MODEL_PATH в ENGINE_CACHE_DIR до запуска воркеров (см. gunicorn.conf.py)"""
+    resolve_model_path(os.getenv('YOLO_MODEL_PATH', 'yolov8n.engine'))
+
+def decode_image(data):
+    """Декодировать байты изображения в BGR np.ndarray (HxWx3 uint8)"""
+    if turbo_jpeg is not None and data[:2] == JPEG_MAGIC:
+        return turbo_jpeg.decode(data, pixel_format=TJPF_BGR)
+    
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Unsupported or corrupted image data")
+    return image
+
+def read_image_bytes(image_path):
+    """Прочитать файл изображения с диска без декодирования (без отдельной проверки существования)"""
+    try:
+        with open(image_path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Image not found: {image_path}") from None
+
+# Ответ без детекций в колоночном формате (только читается при сериализации)
+EMPTY_COLUMNAR_DETECTIONS = {
+    'bbox': np.empty((0, 4), dtype=np.float32),
+    'confidence': np.empty(0, dtype=np.float32),
+    'class_id': np.empty(0, dtype=np.int32),
+    'class': []
+}
 
 class YOLODetector:
-    def __init__(self, model_path="yolov8n.pt", confidence_threshold=0.5):
+    def __init__(self, model_path="yolov8n.engine", confidence_threshold=0.5):
         """Инициализация детектора YOLO"""
         self.confidence_threshold = confidence_threshold
-        logger.info(f"🔄 Loading YOLO model: {model_path}")
+        model_path = resolve_model_path(model_path)
+        
+        # FP16 на Tensor Cores доступен начиная с sm_70 (Volta)
+        self.device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+        self.half = torch.cuda.is_available() and torch.cuda.get_device_capability()[0] >= 7
+        # Порог уверенности применяется внутри YOLO (на GPU), до NMS
+        self.predict_kwargs = {
+            'device': self.device,
+            'half': self.half,
+            'conf': confidence_threshold,
+            'iou': 0.45,
+            'max_det': 100,
+            'agnostic_nms': False,
+            'save': False,
+            'show': False,
+            'stream': False,
+            'verbose': False
+        }
+        
+        # Очистка кеша CUDA-аллокатора - глобальная синхронизация, поэтому раз в N изображений
+        self.empty_cache_every = int(os.getenv('CUDA_EMPTY_CACHE_EVERY', '256'))
+        self._processed_images = 0
+        # Размер пачки одного forward предиктора Ultralytics (PyTorch на CPU)
+        self.max_batch_size = MAX_BATCH_SIZE_LIMIT
+        logger.info(f"🔄 Loading YOLO model: {model_path} (device={self.device}, half={self.half})")
         
         try:
-            self.model = YOLO(model_path)
+            # ONNX - через ONNX Runtime; TensorRT engine и PyTorch-модель на GPU - через собственный
+            # конвейер с pinned-буферами и препроцессингом на GPU; PyTorch на CPU - через предиктор Ultralytics
+            self.model = None
+            self.pipeline = None
+            if model_path.endswith('.onnx'):
+                self.pipeline = OnnxRuntimePipeline(
+                    model_path,
+                    conf=confidence_threshold,
+                    iou=self.predict_kwargs['iou'],
+                    max_det=self.predict_kwargs['max_det']
+                )
+            elif model_path.endswith('.engine'):
+                # Тип входа (FP16/FP32) AutoBackend берёт из binding engine
+                self.pipeline = PinnedInferencePipeline(
+                    AutoBackend(model_path, device=torch.device(self.device), fp16=False, verbose=False),
+                    device=self.device,
+                    half=self.half,
+                    max_batch_size=MAX_BATCH_SIZE_LIMIT,
+                    conf=confidence_threshold,
+                    iou=self.predict_kwargs['iou'],
+                    max_det=self.predict_kwargs['max_det']
+                )
+                logger.info("📌 Using pinned-memory CUDA pipeline with TensorRT engine")
+            else:
+                self.model = YOLO(model_path)
+                if self.device != 'cpu' and isinstance(self.model.model, torch.nn.Module):
+                    self.pipeline = PinnedInferencePipeline(
+                        self.model.model,
+                        device=self.device,
+                        half=self.half,
+                        max_batch_size=MAX_BATCH_SIZE_LIMIT,
+                        conf=confidence_threshold,
+                        iou=self.predict_kwargs['iou'],
+                        max_det=self.predict_kwargs['max_det'],
+                        use_cuda_graph=os.getenv('CUDA_GRAPHS', 'true').lower() == 'true'
+                    )
+                    logger.info("📌 Using pinned-memory CUDA pipeline")
+            
+            # JPEG из запросов декодируется nvJPEG сразу на GPU (только для собственного CUDA-конвейера)
+            self.gpu_jpeg_decode = (
+                isinstance(self.pipeline, PinnedInferencePipeline)
+                and os.getenv('GPU_JPEG_DECODE', 'true').lower() == 'true'
+            )
             logger.info("✅ YOLO model loaded successfully")
             
-            # Тестовый запуск для "разогрева" модели
+            # Тестовый запуск для "разогрева" модели (для TensorRT выделяет execution context)
             test_image = np.zeros((640, 640, 3), dtype=np.uint8)
-            _ = self.model(test_image, verbose=False)
+            _ = self._infer([test_image])
             logger.info("🚀 Model warmed up and ready")
             
+            # Имена классов как массив: индексируется сразу вектором class_id
+            names = self.pipeline.names if self.pipeline is not None else self.model.predictor.model.names
+            self.class_names = np.array([names[i] for i in range(len(names))], dtype=object)
+            
         except Exception as e:
             logger.error(f"❌ Failed to load YOLO model: {e}")
             raise
     
-    def detect(self, image_path):
-        """Выполнить детекцию объектов на изображении"""
-        logger.info(f"🔍 Starting detection for: {image_path}")
-        
-        if not os.path.exists(image_path):
-            logger.error(f"❌ File not found: {image_path}")
-            raise FileNotFoundError(f"Image not found: {image_path}")
-        
-        logger.info(f"✅ File exists, size: {os.path.getsize(image_path)} bytes")
+    def detect_batch(self, images, image_paths, columnar=None):
+        """Выполнить детекцию на пачке декодированных изображений одним вызовом модели
         
+        columnar - флаги колоночного формата ответа для каждого изображения (по умолчанию все False)
+        """
         start_time = time.time()
+        columnar = columnar or [False] * len(images)
         
         try:
-            results = self.model(image_path, verbose=False)
+            batch_boxes = self._infer(images)
             detection_time = time.time() - start_time
-            logger.info(f"✅ YOLO completed in {detection_time:.2f}s")
-            
-            detections = []
-            total_objects = 0
-            
-            for result in results:
-                if result.boxes is not None and len(result.boxes) > 0:
-                    logger.info(f"📦 Found {len(result.boxes)} boxes")
-                    for box, conf, cls in zip(
-                        result.boxes.xyxy.cpu().numpy(),
-                        result.boxes.conf.cpu().numpy(), 
-                        result.boxes.cls.cpu().numpy()
-                    ):
-                        if conf >= self.confidence_threshold:
-                            detections.append({
-                                'class': result.names[int(cls)],
-                                'class_id': int(cls),
-                                'confidence': float(conf),
-                                'bbox': {
-                                    'x1': float(box[0]),
-                                    'y1': float(box[1]), 
-                                    'x2': float(box[2]),
-                                    'y2': float(box[3])
-                                }
-                            })
-                            total_objects += 1
-                else:
-                    logger.info("📦 No boxes found in results")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"✅ YOLO completed for {len(image_paths)} image(s) in {detection_time:.2f}s")
             
+            batch_detections = [
+                self._extract_detections(boxes, is_columnar)
+                for boxes, is_columnar in zip(batch_boxes, columnar)
+            ]
+            del batch_boxes
+            self._release_cuda_memory(len(image_paths))
             processing_time = time.time() - start_time
             
-            return {
+            return [{
                 'success': True,
                 'image_path': image_path,
                 'detections': detections,
                 'total_objects': total_objects,
                 'processing_time_ms': round(processing_time * 1000, 2),
                 'model_confidence_threshold': self.confidence_threshold
-            }
+            } for image_path, (detections, total_objects) in zip(image_paths, batch_detections)]
             
         except Exception as e:
-            logger.error(f"❌ Detection failed for {image_path}: {e}")
-            return {
+            logger.error(f"❌ Detection failed for {image_paths}: {e}")
+            return [{
                 'success': False,
                 'error': str(e),
                 'image_path': image_path
+            } for image_path in image_paths]
+    
+    def _infer(self, images):
+        """Прогон модели пачками по max_batch_size; для каждого изображения тензор [N, 6]: x1, y1, x2, y2, conf, cls"""
+        if self.pipeline is not None:
+            return self.pipeline(images)
+        
+        boxes = []
+        with torch.inference_mode():
+            for start in range(0, len(images), self.max_batch_size):
+                results = self.model(images[start:start + self.max_batch_size], **self.predict_kwargs)
+                boxes.extend(result.boxes.data if result.boxes is not None else None for result in results)
+        return boxes
+    
+    def _release_cuda_memory(self, images_count):
+        """Собрать циклические ссылки на результаты и вернуть драйверу кеш аллокатора раз в empty_cache_every изображений"""
+        if not torch.cuda.is_available() or self.empty_cache_every <= 0:
+            return
+        
+        previous = self._processed_images
+        self._processed_images += images_count
+        if previous // self.empty_cache_every != self._processed_images // self.empty_cache_every:
+            gc.collect()
+            torch.cuda.empty_cache()
+    
+    def _extract_detections(self, boxes, columnar=False):
+        """Преобразовать боксы одного изображения в детекции; возвращает (детекции, количество)
+        
+        columnar=True - параллельные массивы bbox/confidence/class_id/class вместо списка словарей
+        """
+        # Пустой кадр - частый случай: форма тензора известна без синхронизации с GPU,
+        # поэтому ни D2H-копии, ни numpy-обработки не делаем
+        if boxes is None or boxes.shape[0] == 0:
+            logger.debug("📦 No boxes found in results")
+            return (EMPTY_COLUMNAR_DETECTIONS if columnar else []), 0
+        
+        # Одна D2H-копия вместо трёх: колонки x1, y1, x2, y2, conf, cls
+        boxes_all = boxes.float().cpu().numpy()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"📦 Found {len(boxes_all)} boxes")
+        kept = boxes_all[boxes_all[:, 4] >= self.confidence_threshold]
+        
+        class_ids = kept[:, 5].astype(np.int32)
+        class_names = self.class_names[class_ids]
+        
+        # numpy-массивы и скаляры без приведения к float/int: их сериализует orjson (OPT_SERIALIZE_NUMPY)
+        if columnar:
+            return {
+                'bbox': np.ascontiguousarray(kept[:, :4]),
+                'confidence': np.ascontiguousarray(kept[:, 4]),
+                'class_id': class_ids,
+                'class': class_names.tolist()
+            }, len(kept)
+        
+        return [{
+            'class': class_name,
+            'class_id': class_id,
+            'confidence': conf,
+            'bbox': {
+                'x1': x1,
+                'y1': y1,
+                'x2': x2,
+                'y2': y2
             }
+        } for (x1, y1, x2, y2, conf, _), class_id, class_name in zip(kept, class_ids, class_names)], len(kept)
 
-# Глобальный детектор - будет инициализирован при первом запросе
+class BatchScheduler:
+    """Микробатчинг на asyncio: одна корутина собирает пачки из очереди и отдаёт их модели"""
+    
+    def __init__(self, detector, max_batch_size=8, max_wait_ms=10):
+        self.detector = detector
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        # Модель вызывается из одного потока: предиктор Ultralytics и CUDA-буферы не потокобезопасны
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inference')
+        self.worker = None
+    
+    def start(self):
+        """Запустить корутину сборки пачек в текущем event loop"""
+        self.worker = asyncio.create_task(self._run())
+        logger.info(f"📥 Batch scheduler started (max_batch_size={self.max_batch_size}, max_wait={self.max_wait * 1000:g}ms)")
+    
+    async def stop(self):
+        """Остановить корутину и поток инференса"""
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown(wait=False)
+    
+    async def run(self, func, *args):
+        """Выполнить функцию в потоке инференса, последовательно с пачками"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+    
+    async def submit(self, image, image_path, columnar=False):
+        """Поставить декодированное изображение в очередь и дождаться результата детекции"""
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((image, image_path, columnar, future))
+        return await future
+    
+    async def _collect_batch(self):
+        """Дождаться первого запроса и добрать пачку, пока не истечёт окно ожидания"""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        return batch
+    
+    async def _run(self):
+        """Цикл планировщика: одна пачка - один вызов модели в потоке инференса"""
+        while True:
+            # Запросы, отменённые по таймауту, в пачку не попадают
+            pending = [item for item in await self._collect_batch() if not item[3].done()]
+            if not pending:
+                continue
+            
+            images, image_paths, columnar, futures = zip(*pending)
+            try:
+                results = await self.run(self.detector.detect_batch, list(images), list(image_paths), list(columnar))
+            except Exception as e:
+                logger.error(f"❌ Batch processing failed: {e}")
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
+
+# Глобальный детектор и планировщик - инициализируются при старте воркера
 detector = None
+scheduler = None
+_init_lock = threading.Lock()
+
+DETECT_RESULT_TIMEOUT = 30
+# Максимум путей в одном запросе /detect_batch; на GPU они идут пачками не больше YOLODetector.max_batch_size
+DETECT_BATCH_MAX_PATHS = int(os.getenv('DETECT_BATCH_MAX_PATHS', '16'))
 
 def get_detector():
     """Ленивая инициализация детектора"""
     global detector
-    if detector is None:
-        model_path = os.getenv('YOLO_MODEL_PATH', 'yolov8n.pt')
-        confidence = float(os.getenv('CONFIDENCE_THRESHOLD', '0.5'))
-        logger.info(f"🚀 Initializing detector with model: {model_path}")
-        detector = YOLODetector(model_path=model_path, confidence_threshold=confidence)
+    with _init_lock:
+        if detector is None:
+            model_path = os.getenv('YOLO_MODEL_PATH', 'yolov8n.engine')
+            confidence = float(os.getenv('CONFIDENCE_THRESHOLD', '0.5'))
+            logger.info(f"🚀 Initializing detector with model: {model_path}")
+            detector = YOLODetector(model_path=model_path, confidence_threshold=confidence)
     return detector
 
-@app.route('/health', methods=['GET'])
-def health_check():
+def create_scheduler(det):
+    """Создание планировщика пачек с параметрами из окружения"""
+    max_batch_size = int(os.getenv('BATCH_MAX_SIZE', str(MAX_BATCH_SIZE_LIMIT)))
+    if max_batch_size > MAX_BATCH_SIZE_LIMIT:
+        logger.warning(f"⚠️ BATCH_MAX_SIZE={max_batch_size} is capped to {MAX_BATCH_SIZE_LIMIT}")
+        max_batch_size = MAX_BATCH_SIZE_LIMIT
+    max_wait_ms = float(os.getenv('BATCH_MAX_WAIT_MS', '10'))
+    return BatchScheduler(det, max_batch_size=max(1, max_batch_size), max_wait_ms=max_wait_ms)
+
+async def decode_request_image(data):
+    """Декодировать изображение из запроса: JPEG - через nvJPEG на GPU, если доступно, иначе на CPU в пуле потоков"""
+    if detector.gpu_jpeg_decode and data[:2] == JPEG_MAGIC:
+        # В потоке инференса: ошибка декодирования затронет только этот запрос, а не всю пачку
+        try:
+            return await scheduler.run(detector.pipeline.decode_jpeg, data)
+        except RuntimeError as e:
+            # nvJPEG не поддерживает часть JPEG (CMYK, некоторые субдискретизации) - их декодирует CPU
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"🔁 nvJPEG failed, decoding on CPU: {e}")
+    return await run_in_threadpool(decode_image, data)
+
+async def load_request_image(image_path):
+    """Прочитать файл в пуле потоков и декодировать его для детекции"""
+    return await decode_request_image(await run_in_threadpool(read_image_bytes, image_path))
+
+def log_detection(image_name, size, result):
+    """Единственная INFO-запись на запрос: агрегированные показатели детекции"""
+    logger.info(
+        f"✅ Detection completed: image={image_name} bytes={size} "
+        f"objects={result['total_objects']} time_ms={result['processing_time_ms']}"
+    )
+
+def is_columnar_request(request):
+    """Клиент запросил колоночный формат детекций (?format=columnar)"""
+    return request.query_params.get('format') == 'columnar'
+
+def initialize_detector(memory_fraction=None):
+    """Загрузка модели в процессе воркера (CUDA-контекст не переживает fork, поэтому после него)"""
+    if memory_fraction is not None and torch.cuda.is_available():
+        # Несколько воркеров делят один GPU - ограничиваем долю памяти каждого
+        torch.cuda.set_per_process_memory_fraction(memory_fraction)
+        logger.info(f"🧮 CUDA memory fraction per worker: {memory_fraction:.2f}")
+    return get_detector()
+
+@app.get('/health')
+async def health_check():
     """Проверка здоровья сервиса"""
-    return jsonify({
+    return {
         'status': 'healthy',
         'service': 'yolo-detection-service',
         'model_loaded': detector is not None
-    })
+    }
 
-@app.route('/detect', methods=['POST'])
-def detect():
-    """Основной эндпоинт для детекции объектов"""
+@app.post('/detect')
+async def detect(request: Request):
+    """Детекция по пути к файлу на общем томе (устарел, используйте /detect_bytes)"""
     try:
-        # Инициализация детектора при первом запросе
-        det = get_detector()
-        
-        data = request.get_json()
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
         
-        if not data or 'image_path' not in data:
-            return jsonify({
+        if not isinstance(data, dict) or 'image_path' not in data:
+            return ORJSONResponse({
                 'success': False,
                 'error': 'Missing image_path in request'
-            }), 400
+            }, 400)
         
         image_path = data['image_path']
-        logger.info(f"🔍 Processing detection request for: {os.path.basename(image_path)}")
+        if not isinstance(image_path, str):
+            return ORJSONResponse({
+                'success': False,
+                'error': 'image_path must be a string'
+            }, 400)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"🔍 Processing detection request for: {os.path.basename(image_path)}")
+        
+        # Чтение в пуле потоков, параллельно с инференсом текущей пачки
+        image_bytes = await run_in_threadpool(read_image_bytes, image_path)
+        image = await decode_request_image(image_bytes)
+        result = await asyncio.wait_for(
+            scheduler.submit(image, image_path, is_columnar_request(request)), DETECT_RESULT_TIMEOUT
+        )
+        
+        if result['success']:
+            log_detection(os.path.basename(image_path), len(image_bytes), result)
+        
+        return ORJSONResponse(result, headers={'Deprecation': 'true'})
+        
+    except asyncio.TimeoutError:
+        logger.error(f"❌ Detection timed out after {DETECT_RESULT_TIMEOUT}s")
+        return ORJSONResponse({
+            'success': False,
+            'error': f'Detection timed out after {DETECT_RESULT_TIMEOUT}s'
+        }, 504)
+    except Exception as e:
+        logger.error(f"❌ Request processing failed: {e}")
+        return ORJSONResponse({
+            'success': False,
+            'error': f'Request processing failed: {str(e)}'
+        }, 500)
+
+@app.post('/detect_bytes')
+async def detect_bytes(request: Request):
+    """Детекция по изображению в теле запроса (multipart поле image или сырые байты)"""
+    try:
+        if request.headers.get('content-type', '').startswith('multipart/form-data'):
+            # Тело multipart уже прочитано формой: без файла в поле image читать больше нечего
+            upload = (await request.form()).get('image')
+            if upload is None or isinstance(upload, str):
+                return ORJSONResponse({
+                    'success': False,
+                    'error': 'Missing image data in request'
+                }, 400)
+            data = await upload.read()
+            image_name = upload.filename
+        else:
+            data = await request.body()
+            image_name = None
+        
+        if not data:
+            return ORJSONResponse({
+                'success': False,
+                'error': 'Missing image data in request'
+            }, 400)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"🔍 Processing detection request for uploaded image ({len(data)} bytes)")
+        
+        try:
+            image = await decode_request_image(data)
+        except Exception as e:
+            return ORJSONResponse({
+                'success': False,
+                'error': f'Failed to decode image: {str(e)}'
+            }, 400)
         
-        result = det.detect(image_path)
+        result = await asyncio.wait_for(
+            scheduler.submit(image, image_name, is_columnar_request(request)), DETECT_RESULT_TIMEOUT
+        )
         
         if result['success']:
-            logger.info(f"✅ Detection completed: {result['total_objects']} objects found in {result['processing_time_ms']}ms")
+            log_detection(image_name, len(data), result)
         
-        return jsonify(result)
+        return ORJSONResponse(result)
+        
+    except asyncio.TimeoutError:
+        logger.error(f"❌ Detection timed out after {DETECT_RESULT_TIMEOUT}s")
+        return ORJSONResponse({
+            'success': False,
+            'error': f'Detection timed out after {DETECT_RESULT_TIMEOUT}s'
+        }, 504)
+    except Exception as e:
+        logger.error(f"❌ Request processing failed: {e}")
+        return ORJSONResponse({
+            'success': False,
+            'error': f'Request processing failed: {str(e)}'
+        }, 500)
+
+@app.post('/detect_batch')
+async def detect_batch(request: Request):
+    """Детекция по списку путей одним вызовом модели, без ожидания в очереди планировщика"""
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
         
+        image_paths = data.get('image_paths') if isinstance(data, dict) else None
+        if not isinstance(image_paths, list) or not image_paths:
+            return ORJSONResponse({
+                'success': False,
+                'error': 'Missing image_paths in request'
+            }, 400)
+        
+        if len(image_paths) > DETECT_BATCH_MAX_PATHS:
+            return ORJSONResponse({
+                'success': False,
+                'error': f'Too many images in batch: {len(image_paths)} > {DETECT_BATCH_MAX_PATHS}'
+            }, 400)
+        
+        if not all(isinstance(path, str) for path in image_paths):
+            return ORJSONResponse({
+                'success': False,
+                'error': 'image_paths must be a list of strings'
+            }, 400)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"🔍 Processing batch detection request for {len(image_paths)} images")
+        
+        # Нечитаемые файлы дают ошибку только в своём элементе ответа
+        loaded = await asyncio.gather(*(load_request_image(path) for path in image_paths), return_exceptions=True)
+        ready = [(path, image) for path, image in zip(image_paths, loaded) if not isinstance(image, Exception)]
+        
+        detected = []
+        if ready:
+            paths, images = map(list, zip(*ready))
+            columnar = [is_columnar_request(request)] * len(images)
+            # Через поток инференса планировщика: модель не вызывается из двух потоков одновременно
+            detected = await asyncio.wait_for(
+                scheduler.run(detector.detect_batch, images, paths, columnar), DETECT_RESULT_TIMEOUT
+            )
+        
+        detected = iter(detected)
+        results = [{
+            'success': False,
+            'error': str(image),
+            'image_path': path
+        } if isinstance(image, Exception) else next(detected) for path, image in zip(image_paths, loaded)]
+        
+        logger.info(
+            f"✅ Batch detection completed: images={len(results)} "
+            f"objects={sum(r.get('total_objects', 0) for r in results)}"
+        )
+        
+        return ORJSONResponse({'success': True, 'results': results})
+        
+    except asyncio.TimeoutError:
+        logger.error(f"❌ Batch detection timed out after {DETECT_RESULT_TIMEOUT}s")
+        return ORJSONResponse({
+            'success': False,
+            'error': f'Detection timed out after {DETECT_RESULT_TIMEOUT}s'
+        }, 504)
     except Exception as e:
         logger.error(f"❌ Request processing failed: {e}")
-        return jsonify({
+        return ORJSONResponse({
             'success': False,
             'error': f'Request processing failed: {str(e)}'
-        }), 500
+        }, 500)
 
-@app.route('/model/info', methods=['GET'])
-def model_info():
+@app.get('/model/info')
+async def model_info():
     """Информация о загруженной модели"""
     det = get_detector()
     
-    return jsonify({
+    return {
         'model_loaded': True,
         'confidence_threshold': det.confidence_threshold,
-        'available_classes': list(det.model.names.values()) if det.model else []
-    })
+        'available_classes': det.class_names.tolist()
+    }
 
 if __name__ == '__main__':
-    # Для локального запуска через python main.py
+    # Для локального запуска через python main.py; в продакшене - gunicorn -c gunicorn.conf.py main:app
     host = os.getenv('HOST', '0.0.0.0')
     port = int(os.getenv('PORT', 5000))
     logger.info(f"🌟 Starting YOLO Detection Service (DEV MODE) on {host}:{port}")
-    app.run(host=host, port=port, debug=True)
\ No newline at end of file
+    uvicorn.run(app, host=host, port=port)
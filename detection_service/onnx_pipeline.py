@@ -0,0 +1,72 @@
+"""
+Инференс YOLOv8 через ONNX Runtime
+Вариант без TensorRT: оптимизированный граф на CPU.
+requirements.txt ставит CPU-сборку onnxruntime; CUDA Execution Provider появляется только
+при замене её на onnxruntime-gpu в GPU-образе
+"""
+
+import ast
+import logging
+
+import cv2
+import numpy as np
+import onnxruntime as ort
+import torch
+from ultralytics.utils import ops
+
+from gpu_pipeline import LETTERBOX_PAD_VALUE, letterbox_geometry
+
+logger = logging.getLogger(__name__)
+
+PREFERRED_PROVIDERS = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+
+class OnnxRuntimePipeline:
+    """Инференс ONNX-модели YOLO (экспорт с dynamic=False, пачка из одного кадра)"""
+
+    def __init__(self, model_path, conf=0.25, iou=0.45, max_det=100):
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+
+        options = ort.SessionOptions()
+        # Слияние conv+add+activation и прочие графовые оптимизации
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = [p for p in PREFERRED_PROVIDERS if p in ort.get_available_providers()]
+        if torch.cuda.is_available() and 'CUDAExecutionProvider' not in providers:
+            logger.warning("⚠️ CUDA is available but onnxruntime has no CUDAExecutionProvider "
+                           "(install onnxruntime-gpu), running ONNX model on CPU")
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=providers)
+        logger.info(f"🧩 ONNX Runtime providers: {self.session.get_providers()}")
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.imgsz = model_input.shape[2]
+        self.input_dtype = np.float16 if model_input.type == 'tensor(float16)' else np.float32
+
+        # Ultralytics сохраняет имена классов в метаданных ONNX как repr словаря
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata['names'])
+
+    def _letterbox(self, image):
+        """Letterbox на CPU: BGR -> RGB, HWC -> NCHW, /255"""
+        height, width = image.shape[:2]
+        new_height, new_width, top, left = letterbox_geometry(height, width, self.imgsz)
+
+        if (new_height, new_width) != (height, width):
+            image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+        canvas = np.full((self.imgsz, self.imgsz, 3), LETTERBOX_PAD_VALUE, dtype=np.uint8)
+        canvas[top:top + new_height, left:left + new_width] = image
+        blob = canvas[..., ::-1].transpose(2, 0, 1)[np.newaxis].astype(self.input_dtype)
+        return blob / self.input_dtype(255)
+
+    def __call__(self, images):
+        """Детекция на списке BGR-изображений; возвращает тензоры [N, 6] в координатах исходников"""
+        detections = []
+        for image in images:
+            preds = self.session.run(None, {self.input_name: self._letterbox(image)})[0]
+            det = ops.non_max_suppression(torch.from_numpy(preds).float(), self.conf, self.iou, max_det=self.max_det)[0]
+            if det.shape[0]:
+                det[:, :4] = ops.scale_boxes((self.imgsz, self.imgsz), det[:, :4], image.shape)
+            detections.append(det)
+        return detections